@@ -2,14 +2,12 @@
 import argparse
 import os
 import re
-import queue
-import threading
+import signal
 import sys
 import lxml.etree as et
 import xml.etree.ElementTree as xet
 
-from queue import Queue
-from termcolor import colored, cprint
+from concurrent.futures import ProcessPoolExecutor
 
 # Connector to use for representing flattened structure of chained nodes in
 # the map
@@ -21,14 +19,34 @@ LINEBREAK = " \\n "
 # Default freeplane map extensions
 FREEPLANE_MAPS_EXTENSIONS = ".mm"
 
-# Color to use for file name where matches were found 
-FILEPATH_COLOR = "green"
+# Characters which make a keyword a regex rather than a literal string
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
 
-# Color to use for matched text
-MATCH_COLOR = "red"
+# Size (in bytes) of the chunks in which maps are read and fed to the parser
+MAP_READ_CHUNK_SIZE = 1024 * 1024
 
-# Initial Block period (in seconds)
-INIT_BLOCK_PERIOD = 1
+# Literal keywords are searched for with str.find up to this many keywords, and with the 
+# Aho-Corasick automaton (if pyahocorasick is installed) for more keywords
+LITERAL_FIND_MAX_KEYWORDS = 8
+
+# Color (ANSI escape sequence for green) to use for file name where matches were found 
+FILEPATH_COLOR = "\x1b[32m"
+
+# Color (ANSI escape sequence for red) to use for matched text
+MATCH_COLOR = "\x1b[31m"
+
+# Color (ANSI escape sequence for red) to use for error messages
+ERROR_COLOR = "\x1b[31m"
+
+# ANSI escape sequence to reset the color after colored text
+RESET_COLOR = "\x1b[0m"
+
+# Number of chunks of map files to hand to each worker process when the chunk size is not 
+# specified, which leaves some room to balance the load between the workers
+SEARCH_TASKS_CHUNKS_PER_WORKER = 4
+
+# Exit code when the user interrupts the search e.g. via CTRL-C, as for SIGINT in the shell
+INTERRUPTED_EXIT_CODE = 130
 
 # Description for this Script 
 DESCRIPTION = """
@@ -38,17 +56,32 @@ Script to parse and search Freeplane MindMap XML files
 # New Line replacement character
 NEW_LINE_REPLACEMENT = "\\n"
 
-# Global flag to indicate when user interrupts e.g. via CTRL-C
-user_interrupt_flag = threading.Event()
+# Verbose flag to print messages
+verbose_flag = False
 
-# Print queue to be used for printing results
-print_queue = None
+# Color flag to color the matches, file names and errors, set in main and each worker process
+color_flag = True
 
-# Search tasks queue for files to search
-search_tasks_queue = None
+# lxml parser reused for parsing and flattening all the maps in this process
+map_parser = None
 
-# Verbose flag to print messages
-verbose_flag = False
+# Compiled keyword patterns to search for, set in each worker process
+search_patterns = None
+
+# Combined alternation pattern of the keywords to search for, set in each worker process
+combined_search_pattern = None
+
+# Aho-Corasick automaton for literal keywords to search for, set in each worker process
+keyword_automaton = None
+
+# Literal keywords to search for with str.find, set in each worker process
+literal_keywords = None
+
+# Flag to replace new lines in matches, set in each worker process
+replace_newlines_flag = False
+
+# Flag to only validate the maps, set in each worker process
+validate_only_flag = False
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawTextHelpFormatter):
     """Class for custom formatting of Argparse
@@ -61,7 +94,11 @@ def error(msg):
     Args:
         msg (msg): Error message
     """
-    text = colored("[-] " + msg, "red")
+    global color_flag
+
+    text = "[-] " + msg
+    if color_flag:
+        text = ERROR_COLOR + text + RESET_COLOR
     print(text)
 
 def debug(msg):
@@ -86,17 +123,195 @@ def warning(msg):
     if verbose_flag:
         print("[!] " + msg)
 
+class FreeplaneFlattenTarget:
+    """lxml parser target to flatten the Freeplane map as it is parsed, one line per chain of 
+    nodes from the root node to a leaf node. The parser calls the target for each tag instead of 
+    building any XML elements
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, map_file=None):
+        """Reset the target to flatten a new map
+
+        Args:
+            map_file (str, optional): Freeplane XML Mindmap file being parsed, for the warnings. 
+                Defaults, None.
+        """
+        self.map_file = map_file
+
+        # Texts of the current chain of nodes, starting with empty text for the connector at 
+        # the start of each chain
+        self.path = ['']
+
+        # Whether each node in the current chain of nodes has child nodes
+        self.has_children = []
+
+        # Whether each node in the current chain of nodes takes its text from richcontent as 
+        # node text not available
+        self.use_richcontent = []
+
+        # Depth within the richcontent element being read for node text, and its text
+        self.richcontent_depth = 0
+        self.richcontent_text = []
+
+        # Depth within the other children of the current node e.g. icons, fonts
+        self.other_depth = 0
+
+        # Flattened chains of nodes not yet taken
+        self.lines = []
+
+    def start(self, tag, attrib):
+        """Called by the parser for each start tag
+
+        Args:
+            tag (str): Tag
+            attrib (dict): Attributes of the tag
+        """
+        if self.richcontent_depth:
+            self.richcontent_depth += 1
+        elif tag == 'node':
+            if self.has_children:
+                self.has_children[-1] = True
+            current_node_text = attrib.get('TEXT', '')
+            self.path.append(current_node_text)
+            self.has_children.append(False)
+            self.use_richcontent.append(not current_node_text)
+        elif tag == 'richcontent' and self.use_richcontent and self.use_richcontent[-1]:
+            self.richcontent_depth = 1
+            self.richcontent_text = []
+        elif self.use_richcontent:
+            if not self.other_depth and self.use_richcontent[-1]:
+                warning(f"Observed unknown child of type: {tag} for current_node in map file: {self.map_file}")
+            self.other_depth += 1
+
+    def end(self, tag):
+        """Called by the parser for each end tag
+
+        Args:
+            tag (str): Tag
+        """
+        if self.richcontent_depth:
+            self.richcontent_depth -= 1
+            if not self.richcontent_depth:
+                self.path[-1] += "".join(self.richcontent_text).strip()
+        elif tag == 'node':
+            if self.has_children:
+                self.end_node()
+        elif self.other_depth:
+            self.other_depth -= 1
+
+    def data(self, data):
+        """Called by the parser for the text within the tags
+
+        Args:
+            data (str): Text
+        """
+        if self.richcontent_depth:
+            self.richcontent_text.append(data)
+
+    def end_node(self):
+        """End the current node in the chain of nodes
+        """
+        # If we reach the end of the chain, that is one single flow
+        if not self.has_children.pop():
+            self.lines.append(NODE_CONNECTOR.join(self.path))
+        self.path.pop()
+        self.use_richcontent.pop()
+
+    def take_lines(self):
+        """Take the flattened chains of nodes found so far
+
+        Returns:
+            list: Flattened chains of nodes
+        """
+        lines = self.lines
+        self.lines = []
+        return lines
+
+    def close(self):
+        """Called by the parser at the end of the map. Nodes left open in a broken map are ended
+
+        Returns:
+            list: Flattened chains of nodes not yet taken
+        """
+        self.richcontent_depth = 0
+        self.other_depth = 0
+        while self.has_children:
+            self.end_node()
+        lines = self.take_lines()
+        self.reset()
+        return lines
+
+def get_map_parser():
+    """Get the lxml parser for the Freeplane maps, which is created once per process and reused 
+    for each map rather than set up again for every map
+
+    Returns:
+        lxml.etree.XMLParser: Parser that recovers from errors in the maps, which flattens the 
+            maps with its FreeplaneFlattenTarget
+    """
+    global map_parser
+
+    if map_parser is None:
+        map_parser = et.XMLParser(target=FreeplaneFlattenTarget(), recover=True, huge_tree=True)
+    return map_parser
+
+def read_map_file(map_file):
+    """Read the Freeplane XML map in chunks, hinting the kernel that it is read sequentially
+
+    Args:
+        map_file (str): Freeplane XML Mindmap file to read
+
+    Yields:
+        bytes: Chunks of the contents of the map
+    """
+    with open(map_file, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        for chunk in iter(lambda: f.read(MAP_READ_CHUNK_SIZE), b''):
+            yield chunk
+
+def flatten_freeplane_map(map_file):
+    """Flatten the Freeplane map as it is read and parsed, one line per chain of nodes from the 
+    root node to a leaf node. Only the current chain of nodes is held in memory.
+
+    Note that in a broken map, the nodes are chained as the parser recovers them. e.g. for a 
+    node with a broken start tag followed by a sibling node, the sibling is chained under the 
+    broken node, unlike when the map was parsed into a tree
+
+    Args:
+        map_file (str): Freeplane XML Mindmap file to parse
+
+    Yields:
+        str: Flattened chain of nodes from the root node to a leaf node
+    """
+    parser = get_map_parser()
+    parser.target.reset(map_file)
+    try:
+        for chunk in read_map_file(map_file):
+            parser.feed(chunk)
+            yield from parser.target.take_lines()
+    except BaseException:
+        # Close the parser so that it can be reused for the next map, ignoring its own error 
+        # so that the original error is raised
+        try:
+            parser.close()
+        except et.XMLSyntaxError:
+            pass
+        raise
+    yield from parser.close()
+
 def open_freeplane_map(map_file, validate_only=False):
-    """Open the Freeplane XML map and parse the Freeplane map recursively
+    """Open the Freeplane XML map and flatten the Freeplane map
 
     Args:
         map_file (str): Freeplane XML Mindmap file to parse
         validate_only (bool, optional): Whether to validate Freeplane Map. Defaults, False.
 
-    Returns:
-        list: Structure of the Mindmap one-per-line
+    Yields:
+        str: Structure of the Mindmap one-per-line, as the map is parsed
     """
-    map_structure = []
     if not os.path.isfile(map_file):
         error(f"File: {map_file} not found")
     else:
@@ -105,248 +320,434 @@ def open_freeplane_map(map_file, validate_only=False):
                 # Validating the mindmap only
                 tree = xet.parse(map_file)
             else:
-
                 # Parse the freeplane mindmap with lxml for limited errors
                 # and parsing
-                parser = et.XMLParser(recover=True)
-                tree = et.parse(map_file, parser=parser)
-                
-                # Parse the root ('map' tag)
-                root = tree.getroot()
-
-                # Parse each node
-                for c in root:
-                    if c.tag == 'node': 
-                        flatten_freeplane_node(map_file, map_structure, '', c)
+                yield from flatten_freeplane_map(map_file)
         except Exception as e:
             error(f"Exception parsing freeplane map: {map_file}. Error: {e.__class__}, {e}")
 
-    return map_structure
+def compile_keywords(keywords, delimiter, case_sensitive=False):
+    """Compile the keywords to search for into regex patterns once per search job
 
-def flatten_freeplane_node(map_file, map_structure, prev_text, node):
-    """Parse Freeplane child nodes recursively
+    Args:
+        keywords (str): Regex string to search for in the map
+        delimiter (str): Delimiter to use form multiple keywords
+        case_sensitive (bool, optional): Whether the search should be case-sensitive or not. Defaults, False
+
+    Returns:
+        list: List of compiled regex patterns (re.Pattern), one per keyword
+    """
+    flags = 0 if case_sensitive else re.I
+    return [re.compile(kw, flags) for kw in keywords.split(delimiter)]
+
+def combine_patterns(patterns):
+    """Combine the keyword patterns into a single alternation pattern, so that each line is
+    scanned once for all the keywords. Group i+1 of the combined pattern matches keyword i
 
     Args:
-        map_structure (list): Map structure to parse
-        prev_text (str): Previous text for this freeplane chain of nodes
-        node (xml.etree.ElementTree): XML element to recursively parse and flatten
+        patterns (list): Compiled regex patterns for the keywords
+
+    Returns:
+        re.Pattern: Combined pattern, None if the keywords can't be combined e.g. as they
+            have groups of their own which would shift the group numbers
     """
-    num_children_processed = 0
-    
-    # Regex filter for cleaning the HTML tags in richcontent 
-    clean_http_tags = None
-
-    # Get the current node's text
-    current_node_text = node.attrib.get('TEXT', '')
-    # Look for richcontent if node text not available
-    if not current_node_text:
-        # look at the children of the node (can we see any rich content)
-        for c in node.getchildren():
-            if c.tag == 'richcontent':
-                if not clean_http_tags:
-                    clean_http_tags = re.compile('<.*?>') 
-
-                # Parse the internal text
-                current_node_text += re.sub(clean_http_tags, '', et.tostring(c).decode()).strip()
-            else:
-                warning(f"Observed unknown child of type: {c.tag} for current_node in map file: {map_file}")
-    
-    prev_text += NODE_CONNECTOR + current_node_text
-    
-    for c in node:
-        if c.tag == 'node':
-            flatten_freeplane_node(map_file, map_structure, prev_text, c)
-            num_children_processed += 1
-
-    # If we reach the end of the chain, that is one single flow
-    if num_children_processed == 0:
-        map_structure.append(prev_text)
-
-def search_freeplane_map(filepath, map_structure, keywords, delimiter, replace_newlines, 
-    case_sensitive=False):
-    """Search the Freeplane map
+    combined_pattern = None
+    if all(p.groups == 0 for p in patterns):
+        try:
+            combined_pattern = re.compile("(" + ")|(".join(p.pattern for p in patterns) + ")",
+                patterns[0].flags)
+        except re.error as e:
+            debug(f"Unable to combine keywords: {[p.pattern for p in patterns]}. Error: {e}")
+    return combined_pattern
+
+def color_spans(line, spans):
+    """Color the matches in the line in one pass, merging the spans of the matches which overlap
 
     Args:
-        filepath (str): File path to search maps used for printing  
-        map_structure (dict): Structure of map
-        keywords (str): Regex string to search for in the map
-        delimiter (str): Delimiter to use form multiple keywords
-        replace_newlines (bool): Replace new lines
-        case_sensitive (bool, optional): Whether the search should be case-sensitive or not. Defaults, False
+        line (str): Line to color
+        spans (list): Spans (start, end) of the matches in the line, in any order
 
     Returns:
-        list: List of string matches found that have the keywords that were found (that are color formatted)
+        str: Color formatted line
     """
-    lines_found = []
+    merged = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+
+    segments = []
+    last = 0
+    for start, stop in merged:
+        segments.append(line[last:start])
+        segments.append(MATCH_COLOR)
+        segments.append(line[start:stop])
+        segments.append(RESET_COLOR)
+        last = stop
+    segments.append(line[last:])
+    return "".join(segments)
+
+def search_line(line, patterns):
+    """Search a single line for each of the keywords one after another, and color the matches
 
-    # Get the list of keywords to search for
-    keywords_arr = keywords.split(delimiter)
+    Args:
+        line (str): Line to search
+        patterns (list): Compiled regex patterns for the keywords
 
-    debug(f"Searching freeplane map: {filepath} for keywords: {keywords}...")
-    for l in map_structure:
+    Returns:
+        str: Color formatted line if all the keywords were found, None otherwise
+    """
+    # Check that all the keywords are in the line first, stopping at the first keyword not found
+    for pat in patterns:
+        if not pat.search(line):
+            return None
 
-        # Assume keywords match has been found
-        kw_match_found = True
+    if not color_flag:
+        return line
 
-        # Search for keywords and ensure that they are found
-        line_to_search = l
-        for kw in keywords_arr:
-    
-            if case_sensitive:
-                ms = re.search(kw, line_to_search)
-            else:
-                ms = re.search(kw, line_to_search, re.I)
-            if ms:
-
-                # Simply, color the keywords discovered in the line
-                if case_sensitive:
-                    line_to_search = re.sub(kw, lambda m: colored(m.group(), MATCH_COLOR) , line_to_search)
-                else:
-                    line_to_search = re.sub(kw, lambda m: colored(m.group(), MATCH_COLOR) , line_to_search, flags=re.I)
-                
-                # Replace the new lines with characters to replace new lines
-                if replace_newlines:
-                    line_to_search = line_to_search.replace("\n", LINEBREAK)
-                    line_to_search = line_to_search.replace("\r", LINEBREAK)
-            else:
-                # Match wasn't found in line, stop searching
-                kw_match_found = False
-                break
+    # Then color the matches of all the keywords in the original line at once
+    spans = []
+    for pat in patterns:
+        spans.extend(m.span() for m in pat.finditer(line) if m.end() > m.start())
+    return color_spans(line, spans)
 
-        # If keywords found, then append
-        if kw_match_found:
-            lines_found.append(line_to_search)
+def search_line_combined(line, combined_pattern, patterns):
+    """Search a single line for all the keywords in one pass with the combined pattern, and
+    color the matches
 
-    return lines_found
+    Args:
+        line (str): Line to search
+        combined_pattern (re.Pattern): Combined alternation pattern for the keywords
+        patterns (list): Compiled regex patterns for the keywords
 
-def print_matches(block_period=INIT_BLOCK_PERIOD):
-    """Pretty format and print the matches found to the user
+    Returns:
+        str: Color formatted line if all the keywords were found, None otherwise
+    """
+    # Bit i is set once keyword i has been seen in the line
+    seen = 0
+    segments = []
+    last = 0
+    for m in combined_pattern.finditer(line):
+        seen |= 1 << (m.lastindex - 1)
+
+        # Only color the matches which are not empty, and only if coloring
+        if color_flag and m.end() > m.start():
+            segments.append(line[last:m.start()])
+            segments.append(MATCH_COLOR)
+            segments.append(m.group())
+            segments.append(RESET_COLOR)
+            last = m.end()
+
+    if not seen:
+        return None
+
+    # A keyword may be hidden by an overlapping match of another keyword, so check the
+    # keywords that were not seen individually
+    if seen != (1 << len(patterns)) - 1:
+        for i, pat in enumerate(patterns):
+            if not seen & (1 << i) and not pat.search(line):
+                return None
+
+    if not color_flag:
+        return line
+
+    segments.append(line[last:])
+    return "".join(segments)
+
+def is_literal(keyword):
+    """Check whether the keyword is a literal string i.e. has no regex metacharacters
 
     Args:
-        block_period(int): Block period to wait for matches to print
+        keyword (str): Keyword to check
+
+    Returns:
+        bool: True if the keyword is a non-empty literal string, False otherwise
     """
-    global print_queue
+    return bool(keyword) and not any(c in REGEX_METACHARACTERS for c in keyword)
 
-    continue_thread = True
-    while continue_thread:
-        rv = None
-        try:
-            rv = print_queue.get(block=True, timeout=block_period)
-        except queue.Empty:
-            pass
+def get_literal_keywords(patterns):
+    """Get the keywords to search for with str.find if all the keywords are literal strings, 
+    lower-cased for a case-insensitive search
 
-        if rv:
-            map_file, matches = rv['file'], rv['matches']
+    Args:
+        patterns (list): Compiled regex patterns for the keywords
 
-            if matches:
-                print(colored(map_file, FILEPATH_COLOR))
-                for l in matches:
-                    print(l)
-                print()
-        else:
-            continue_thread = False
+    Returns:
+        list: Literal keywords (str), None if the keywords are not all literal
+    """
+    if not all(is_literal(p.pattern) for p in patterns):
+        return None
+
+    # Lower-casing only matches like the case-insensitive regex search for ASCII text
+    if patterns[0].flags & re.I and not all(p.pattern.isascii() for p in patterns):
+        return None
+    return [p.pattern.lower() if p.flags & re.I else p.pattern for p in patterns]
 
+def prepare_literal_line(line, patterns):
+    """Prepare a single line to search for the literal keywords, lower-cased for a 
+    case-insensitive search. See get_literal_keywords for why only ASCII lines are lower-cased
 
-def init_print_queue():
+    Args:
+        line (str): Line to search
+        patterns (list): Compiled regex patterns for the keywords
+
+    Returns:
+        str: Line to search for the literal keywords, None if the line must be searched with 
+            regex instead
     """
-    Returns a queue which contains the matches that were found in each queue
+    if not patterns[0].flags & re.I:
+        return line
+    if not line.isascii():
+        return None
+    return line.lower()
+
+def search_line_find(line, literal_keywords, patterns):
+    """Search a single line for all the literal keywords with str.find rather than regex, and 
+    color the matches
+
+    Args:
+        line (str): Line to search
+        literal_keywords (list): Literal keywords, lower-cased for a case-insensitive search
+        patterns (list): Compiled regex patterns for the keywords
 
     Returns:
-        Queue: A queue that consists of matches to print for each file (a dict which consists of a 'file' and 'matches')
+        str: Color formatted line if all the keywords were found, None otherwise
     """
-    global print_queue
+    line_to_search = prepare_literal_line(line, patterns)
+    if line_to_search is None:
+        return search_line(line, patterns)
+
+    for kw in literal_keywords:
+        if kw not in line_to_search:
+            return None
+
+    if not color_flag:
+        return line
+
+    spans = []
+    for kw in literal_keywords:
+        start = line_to_search.find(kw)
+        while start != -1:
+            spans.append((start, start + len(kw)))
+            start = line_to_search.find(kw, start + len(kw))
+    return color_spans(line, spans)
+
+def order_patterns_by_cost(patterns):
+    """Order the keyword patterns so that the cheapest and most selective keywords are searched
+    first, and most lines are rejected after a single search. Literal keywords come first, 
+    longest first as longer literals match fewer lines, followed by the regex keywords, shortest 
+    first as shorter regexes are usually simpler
+
+    Args:
+        patterns (list): Compiled regex patterns for the keywords
 
-    if not print_queue:
-        print_queue = Queue()
-    return print_queue
+    Returns:
+        list: Compiled regex patterns, ordered by the estimated cost of the search
+    """
+    return sorted(patterns, key=lambda p: (0, -len(p.pattern)) if is_literal(p.pattern) 
+        else (1, len(p.pattern)))
 
-def put_on_print_queue(filepath, matches):
-    """Put file path and matches found on the print queue for printing
+def build_keyword_automaton(literal_keywords):
+    """Build an Aho-Corasick automaton to find all the literal keywords in a single walk of each 
+    line. pyahocorasick is optional and imported lazily
 
     Args:
-        filepath (str): File path for which matches were found
-        matches (list): List of matches for the file
+        literal_keywords (list): Literal keywords from get_literal_keywords
+
+    Returns:
+        ahocorasick.Automaton: Automaton whose values are (bitmask of the indices of the keywords
+            for the word, keyword length), None if pyahocorasick is not installed
     """
-    global print_queue
+    try:
+        import ahocorasick
+    except ImportError:
+        debug("pyahocorasick not installed, searching literal keywords with regex")
+        return None
+
+    # The same word may be given for more than one keyword, so each word maps to the bits of
+    # all its keywords
+    keyword_masks = {}
+    for i, kw in enumerate(literal_keywords):
+        keyword_masks[kw] = keyword_masks.get(kw, 0) | (1 << i)
+
+    automaton = ahocorasick.Automaton()
+    for kw, mask in keyword_masks.items():
+        automaton.add_word(kw, (mask, len(kw)))
+    automaton.make_automaton()
+    return automaton
+
+def search_line_literal(line, keyword_automaton, patterns):
+    """Search a single line for all the literal keywords in one walk with the Aho-Corasick
+    automaton, and color the matches
 
-    debug(f"Putting matches: {len(matches)} found for filepath: {filepath}...")
-    print_queue.put(
-        {'file': filepath,
-        'matches': matches}
-    )
+    Args:
+        line (str): Line to search
+        keyword_automaton (ahocorasick.Automaton): Automaton for the literal keywords
+        patterns (list): Compiled regex patterns for the keywords
 
-def init_search_tasks_queue():
+    Returns:
+        str: Color formatted line if all the keywords were found, None otherwise
     """
+    line_to_search = prepare_literal_line(line, patterns)
+    if line_to_search is None:
+        return search_line(line, patterns)
+
+    # Bit i is set once keyword i has been seen in the line
+    seen = 0
+    spans = []
+    for end, (mask, kw_len) in keyword_automaton.iter(line_to_search):
+        seen |= mask
+        spans.append((end + 1 - kw_len, end + 1))
+
+    if seen != (1 << len(patterns)) - 1:
+        return None
+
+    if not color_flag:
+        return line
+
+    return color_spans(line, spans)
+
+def search_freeplane_map(filepath, map_structure, patterns, replace_newlines, 
+    combined_pattern=None, keyword_automaton=None, literal_keywords=None):
+    """Search the Freeplane map
+
+    Args:
+        filepath (str): File path to search maps used for printing  
+        map_structure (iterable): Structure of map one-per-line, consumed as the map is parsed
+        patterns (list): Compiled regex patterns for the keywords to search for in the map
+        replace_newlines (bool): Replace new lines
+        combined_pattern (re.Pattern, optional): Combined alternation pattern for the keywords
+            to search each line once. Defaults, None to search for each keyword in turn.
+        keyword_automaton (ahocorasick.Automaton, optional): Automaton for literal keywords to
+            search each line once without regex. Defaults, None.
+        literal_keywords (list, optional): Literal keywords to search each line for with 
+            str.find rather than regex. Defaults, None.
+
     Returns:
-        Queue: A queue that consists of collection of files to search
+        list: List of string matches found that have the keywords that were found (that are color formatted)
     """
-    global search_tasks_queue
+    lines_found = []
 
-    if not search_tasks_queue:
-        search_tasks_queue = Queue()
-    return search_tasks_queue
+    debug(f"Searching freeplane map: {filepath} for keywords: {[p.pattern for p in patterns]}...")
+    for l in map_structure:
 
-def put_search_tasks(filepath):
-    """Put a search task which specifies the filepath to search
+        # Search for keywords and ensure that they are found
+        if keyword_automaton:
+            line_found = search_line_literal(l, keyword_automaton, patterns)
+        elif literal_keywords:
+            line_found = search_line_find(l, literal_keywords, patterns)
+        elif combined_pattern:
+            line_found = search_line_combined(l, combined_pattern, patterns)
+        else:
+            line_found = search_line(l, patterns)
+
+        # If keywords found, then append
+        if line_found is not None:
+
+            # Replace the new lines with characters to replace new lines
+            if replace_newlines:
+                line_found = line_found.replace("\n", LINEBREAK)
+                line_found = line_found.replace("\r", LINEBREAK)
+
+            lines_found.append(line_found)
+
+    return lines_found
+
+def init_worker(patterns, replace_newlines, validate_only=False, verbose=False, color=True):
+    """Initialise the search settings for a worker process, called once when each worker
+    process starts
 
     Args:
-        filepath (str): Filepath to search
+        patterns (list): Compiled regex patterns for the keywords to search for in the maps
+        replace_newlines (bool): Replace new lines
+        validate_only (bool, optional): Whether to only validate the freeplane maps. Defaults, False.
+        verbose (bool, optional): Verbose to print messages. Defaults, False.
+        color (bool, optional): Color the matches. Defaults, True.
     """
-    global search_tasks_queue
-    search_tasks_queue.put(filepath)
+    global search_patterns, combined_search_pattern, keyword_automaton, literal_keywords
+    global replace_newlines_flag, validate_only_flag, verbose_flag, color_flag
+
+    # User interrupts e.g. via CTRL-C are handled by the main process only
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    verbose_flag = verbose
+    color_flag = color
+    search_patterns = patterns
+    combined_search_pattern = combine_patterns(patterns)
+    literal_keywords = get_literal_keywords(patterns)
 
-def open_map_and_search(keywords, delimiter, case_sensitive, replace_newlines, 
-    validate_only=False, block_period=INIT_BLOCK_PERIOD):
-    """Open a single map from the queue and search
+    # str.find is quicker than walking the automaton until there are many literal keywords
+    keyword_automaton = None
+    if literal_keywords and len(literal_keywords) > LITERAL_FIND_MAX_KEYWORDS:
+        keyword_automaton = build_keyword_automaton(literal_keywords)
+    replace_newlines_flag = replace_newlines
+    validate_only_flag = validate_only
+
+def open_map_and_search(filepath):
+    """Open a single map and search it for the keywords in a worker process
 
     Args:
-        keywords (str): Keywords to search for in the map file
-        delimiter (str): Delimiter to use for multiple keywords
-        case_sensitive (bool): Case sensitive
-        replace_newlines (str): Newlines for replacement
-        validate_only (bool): Whether to only validate the freeplane map instead of continuing to 
-            parse to show any errors. Defaults, False. 
+        filepath (str): Freeplane map file to open and search
+
+    Returns:
+        tuple: File path (str) searched and the list of matches (list) found in the map
     """
-    global user_interrupt_flag, search_tasks_queue
+    global search_patterns, combined_search_pattern, keyword_automaton, literal_keywords
+    global replace_newlines_flag, validate_only_flag
 
-    continue_thread = True
-    while continue_thread:
+    # Open the freeplane map, which is parsed lazily as its structure is iterated
+    map_structure = open_freeplane_map(filepath, validate_only_flag)
 
-        # Get the file path to search 
-        filepath = None
-        try:
-            filepath = search_tasks_queue.get(block=True, timeout=block_period)
-        except queue.Empty:
+    # if validating freeplane mindmaps only, then we don't search for keywords...
+    lines_found = []
+    if validate_only_flag:
+        for _ in map_structure:
             pass
+    else:
+        # Search the freeplane map for the keywords
+        lines_found = search_freeplane_map(filepath, map_structure, search_patterns, 
+            replace_newlines_flag, combined_search_pattern, keyword_automaton, 
+            literal_keywords)
 
-        if filepath:
+    return filepath, lines_found
 
-            # Open the freeplane map
-            did_user_interrupt = user_interrupt_flag.is_set()
-            if not did_user_interrupt:
-                map_structure = open_freeplane_map(filepath, validate_only)
-            else:
-                continue_thread = False
-
-            # if validating freeplane mindmaps only, then we don't search for keywords...
-            if not validate_only:
-                # Search the freeplane map for the keywords
-                did_user_interrupt = user_interrupt_flag.is_set()
-                if not did_user_interrupt:
-                    lines_found = search_freeplane_map(filepath, map_structure, keywords, delimiter, 
-                        replace_newlines, case_sensitive)
-                else:
-                    continue_thread = False
-
-                # Put the lines found from print queue for printing to terminal
-                did_user_interrupt = user_interrupt_flag.is_set()
-                if not did_user_interrupt:
-                    put_on_print_queue(filepath, lines_found)
-                else:
-                    continue_thread = False
+def print_matches(map_file, matches):
+    """Pretty format and print the matches found in a map file to the user
+
+    Args:
+        map_file (str): File path for which matches were found
+        matches (list): List of matches for the file
+    """
+    if matches:
+        # Format the whole block once and write it out in one go
+        if color_flag:
+            block = FILEPATH_COLOR + map_file + RESET_COLOR + "\n"
         else:
-            continue_thread = False
+            block = map_file + "\n"
+        block += "\n".join(matches) + "\n\n"
+        sys.stdout.write(block)
 
+def walk_map_files(folder, map_extensions):
+    """Walk the folder recursively for the map files with os.scandir, which reuses the file type 
+    from the directory entries instead of calling stat on each file
+
+    Args:
+        folder (str): Folder to walk
+        map_extensions (tuple): Extensions for freeplane files
+
+    Yields:
+        str: File path of each map file in the folder
+    """
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from walk_map_files(entry.path, map_extensions)
+                elif entry.name.endswith(map_extensions):
+                    yield entry.path
+    except OSError as e:
+        warning(f"Unable to list folder: {folder}. Error: {e}")
 
 def list_files_to_check(file_folder, extensions):
     """List files to search
@@ -359,24 +760,21 @@ def list_files_to_check(file_folder, extensions):
 
     """
     files_to_search = []
-    map_extensions = extensions.split(",")
+    map_extensions = tuple(extensions.split(","))
     if os.path.isfile(file_folder):
         files_to_search.append(file_folder)
     elif os.path.isdir(file_folder):
-        for dp, _, files in os.walk(file_folder):
-            for f in files:
-                if any([f.endswith(e) for e in map_extensions ]):
-                    full_path = os.path.join(dp, f)
-                    files_to_search.append(full_path)
+        files_to_search.extend(walk_map_files(file_folder, map_extensions))
     else:
         error(f"Unknown file path: {file_folder}")
 
     return files_to_search
 
-def launch_all_threads(file_folder, keywords, delimiter, case_sensitive, extensions, num_threads,
-    replace_newlines, validate_only=False):
+def launch_all_workers(file_folder, keywords, delimiter, case_sensitive, extensions, num_workers,
+    replace_newlines, validate_only=False, chunk_size=0):
     """
-    Launch all the threads that will perform the search across the various Freeplane Map files
+    Launch all the worker processes that will perform the search across the various Freeplane
+    Map files and print the matches in the order the files were listed
 
     Args:
         file_folder (str): Path to file/folder 
@@ -384,35 +782,50 @@ def launch_all_threads(file_folder, keywords, delimiter, case_sensitive, extensi
         delimiter (str): Delimiter to use for multiple keywords
         case_sensitive (bool): Case sensitive
         extensions (str): List of freeplane file extensions
-        num_threads (int): Number of threads for search tasks
+        num_workers (int): Number of worker processes for search tasks
         replace_new_lines (bool): Replace new lines
         validate_only (bool, optional): Validate mindmap only. Defaults, False.
+        chunk_size (int, optional): Number of map files handed to a worker process at a time. 
+            Defaults, 0 to split the files into a few chunks per worker process.
+
+    Returns:
+        bool: True if all the files were searched, False if the user interrupted the search
     """
+    global verbose_flag, color_flag
 
     files_to_search = list_files_to_check(file_folder, extensions)
-
-    thread_objects = []
-
-    # Launch the threads to open map and search
-    for _ in range(0, num_threads):
-        t = threading.Thread(target=open_map_and_search, args=(keywords, delimiter, case_sensitive,
-            replace_newlines, validate_only))
-        t.start()   
-        thread_objects.append(t)
-
-    # Launch the search threads
-    for fp in files_to_search:
-        put_search_tasks(fp)
-
-    # Launch the thread to print the task
-
-    t = threading.Thread(target=print_matches)
-    t.start()
-    thread_objects.append(t)
-
-    # Join all the threads to the main thread
-    for t in thread_objects:
-        t.join()
+    if not files_to_search:
+        debug(f"No files to search in: {file_folder}")
+        return True
+
+    # No more worker processes than there are files to search
+    num_workers = min(num_workers, len(files_to_search))
+
+    # Hand the files to the workers in chunks rather than one at a time to cut down on the
+    # round trips between the processes
+    if chunk_size <= 0:
+        chunk_size = max(1, len(files_to_search) // (num_workers * SEARCH_TASKS_CHUNKS_PER_WORKER))
+    debug(f"Searching {len(files_to_search)} files in chunks of {chunk_size} files...")
+
+    # Compile the keywords once, the compiled patterns are pickled to each worker process
+    patterns = order_patterns_by_cost(compile_keywords(keywords, delimiter, case_sensitive))
+
+    # Parse and search the maps in separate processes as the work is CPU-bound
+    executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+        initargs=(patterns, replace_newlines, validate_only, verbose_flag, color_flag))
+    completed = False
+    try:
+        for filepath, matches in executor.map(open_map_and_search, files_to_search,
+            chunksize=chunk_size):
+            print_matches(filepath, matches)
+        completed = True
+    except KeyboardInterrupt:
+        error("Search interrupted by user")
+    finally:
+        # Drop the maps not yet searched rather than waiting for the workers to search them
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return completed
 
 
 def main():
@@ -425,8 +838,12 @@ def main():
     parser.add_argument("-f", "--file-folder", default="/opt/my-maps", help="File/folder to search")
     parser.add_argument("-c", "--case-sensitive", action="store_true", 
         help="Keyword search (regex) in the Freeplane files")
-    parser.add_argument("-nt", "--num-threads", default=10, 
-        help="Number of threads to use to search for strings")
+    parser.add_argument("-nt", "--num-threads", default=os.cpu_count() or 1, type=int, 
+        help=("Number of worker processes to use to search for strings, at most one per file "
+              "searched. Defaults to the number of CPUs"))
+    parser.add_argument("-cs", "--chunk-size", default=0, type=int, 
+        help=("Number of files handed to a worker process at a time. 0 splits the files into a "
+              "few chunks per worker, 1 balances the load best when map sizes vary a lot"))
     parser.add_argument("-e", "--extensions", default=FREEPLANE_MAPS_EXTENSIONS, 
         help="Freeplane Map file extensions to use for searching freeplanes")
     parser.add_argument("-v", "--verbose", action="store_true",
@@ -435,19 +852,33 @@ def main():
         help="Replace new lines with '\\n' to allow printing of matches per line")
     parser.add_argument("-va", "--validate", action="store_true", 
         help="Validate the mindmaps only")
+    parser.add_argument("-nc", "--no-color", action="store_true", 
+        help="Don't color the output, which is the default when output is not to a terminal")
 
     args = parser.parse_args()
 
+    # Color only when printing to a terminal, unless forced via FORCE_COLOR environment variable
+    global color_flag
+    color_flag = (not args.no_color and "NO_COLOR" not in os.environ 
+        and (sys.stdout.isatty() or "FORCE_COLOR" in os.environ))
+
+    if args.num_threads < 1:
+        error(f"Number of worker processes: {args.num_threads} must be at least 1")
+        return 1
+
+    if args.chunk_size < 0:
+        error(f"Chunk size: {args.chunk_size} must be 0 or more")
+        return 1
+
     if args.verbose:
         global verbose_flag
         verbose_flag = True
 
-    init_print_queue()
-    
-    init_search_tasks_queue()
-
-    launch_all_threads(args.file_folder, args.keywords, args.delimiter, args.case_sensitive, 
-        args.extensions, int(args.num_threads), args.replace_newlines, args.validate)
+    completed = launch_all_workers(args.file_folder, args.keywords, args.delimiter, 
+        args.case_sensitive, args.extensions, args.num_threads, args.replace_newlines, 
+        args.validate, args.chunk_size)
+    if not completed:
+        return INTERRUPTED_EXIT_CODE
 
 if __name__ == "__main__":
     sys.exit(main())